@@ -1,13 +1,96 @@
 import gradio as gr
-import requests
+import httpx
+import asyncio
+import hashlib
+import io
+import orjson
 import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from html import escape as _esc
+from operator import itemgetter
 from dotenv import load_dotenv
+import soundfile as sf
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (skip reading .env when the deployment already sets them)
+if "API_URL" not in os.environ:
+    load_dotenv()
 
 # API endpoint (change if your API is hosted elsewhere)
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
+_PROCESS_AUDIO_URL = f"{API_URL}/process-audio"
+_EXTRACT_FIELDS_URL = f"{API_URL}/extract-fields"
+
+# Shared async HTTP client: handlers await the API on Gradio's event loop instead
+# of tying up a worker thread, and connections are pooled between requests.
+# The short connect timeout keeps a dead backend from stalling the UI, and the
+# transport transparently retries failed connection attempts.
+_ACLIENT = httpx.AsyncClient(
+    timeout=httpx.Timeout(60.0, connect=3.0),
+    transport=httpx.AsyncHTTPTransport(
+        retries=3,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    )
+)
+
+# Gateway errors worth retrying before surfacing a failure to the user
+_RETRY_STATUSES = frozenset((502, 503, 504))
+_MAX_RETRIES = 3
+_BACKOFF_FACTOR = 0.5
+
+async def _api_post(url, **kwargs):
+    """
+    POST to the API, retrying transient gateway errors with exponential backoff
+    so the user doesn't have to resubmit (and re-upload) their request
+    """
+    for attempt in range(_MAX_RETRIES + 1):
+        # httpx rewinds file fields and _MultipartFileBody re-reads its file on
+        # each send, so uploads can be retried
+        response = await _ACLIENT.post(url, **kwargs)
+        if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+            return response
+        await asyncio.sleep(_BACKOFF_FACTOR * (2 ** attempt))
+
+# Chunk size for streaming an upload from disk
+_UPLOAD_CHUNK_SIZE = 1 << 20
+
+class _MultipartFileBody:
+    """
+    Multipart form body for one file plus plain form fields. The file is read in
+    chunks on a worker thread, so it streams from disk without blocking the event
+    loop, and every iteration starts over so a retried request resends it whole.
+    Build it with asyncio.to_thread, since it stats the file.
+    """
+    def __init__(self, path, field, filename, content_type, data):
+        self.path = path
+        boundary = os.urandom(16).hex()
+        parts = [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in data.items()
+        ]
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        )
+        self.head = "".join(parts).encode()
+        self.tail = f"\r\n--{boundary}--\r\n".encode()
+        self.headers = {
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            # Declared up front so the API can reject an oversize upload before it is sent
+            "Content-Length": str(len(self.head) + os.path.getsize(path) + len(self.tail))
+        }
+    
+    async def __aiter__(self):
+        yield self.head
+        fh = await asyncio.to_thread(open, self.path, 'rb')
+        try:
+            while chunk := await asyncio.to_thread(fh.read, _UPLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await asyncio.to_thread(fh.close)
+        yield self.tail
+
 # Custom CSS for styling
 custom_css = """
 .container {
@@ -87,106 +170,155 @@ th {
     background-color: #f8f9fa;
     font-weight: bold;
 }
+
+/* Extracted fields table (kept here so rows carry no inline styles) */
+.results-table {
+    width: 100%;
+    border-collapse: collapse;
+}
+
+.results-table th, .results-table td {
+    padding: 8px;
+    text-align: left;
+    border-bottom: 1px solid #ddd;
+}
+
+.results-table th {
+    background-color: #f8f9fa;
+    font-weight: bold;
+}
 """
+# Minify once at import: drop comments and collapse whitespace
+custom_css = re.sub(r"\s+", " ", re.sub(r"/\*.*?\*/", "", custom_css, flags=re.DOTALL)).strip()
+
+# Static page markup, built once at import rather than on every Blocks construction
+_TITLE_HTML = "<h1 class='title'>FormsiQ - Mortgage Application Extractor</h1>"
+_INTRO_HTML = "<p>Extract mortgage application details from audio recordings or text transcripts.</p>"
+_INSTRUCTIONS_HTML = """
+<div class='instructions'>
+    <h3>Sample Transcripts</h3>
+    <p>Try these examples:</p>
+    <ol>
+        <li><strong>Complete Application:</strong> "Hi, my name is John Smith. I'd like to apply for a mortgage loan of $350,000. I'm looking to purchase a single-family home at 123 Main Street. My annual income is $120,000 and I've been employed at Tech Corp for 5 years as a software engineer. My credit score is around 750."</li>
+        <li><strong>Refinance Application:</strong> "I'm Robert Johnson calling about refinancing my current mortgage for $300,000. I've owned my home at 789 Oak Drive, Austin, TX for 8 years and the current value is approximately $500,000. I still owe about $300,000 on my mortgage and I'm looking to get a better interest rate."</li>
+    </ol>
+</div>
+"""
+
+# Rendered process_text results keyed by (transcript hash, language), so
+# resubmitting the same transcript skips the API round trip entirely
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_SIZE = 256
 
-def process_audio(audio_file, language="en"):
+def _result_cache_key(transcript_text, language):
+    text_hash = hashlib.sha1(transcript_text.strip().encode()).hexdigest()
+    return text_hash, language
+
+def _cache_result(key, output):
+    _RESULT_CACHE[key] = output
+    _RESULT_CACHE.move_to_end(key)
+    if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+        _RESULT_CACHE.popitem(last=False)
+
+# Markup for the extracted-fields table
+_TABLE_HEAD = "<table class='results-table'><tr><th>Field</th><th>Value</th><th>Confidence</th></tr>"
+_ROW_TMPL = (
+    "<tr>"
+    "<td><span class='field-name'>{name}</span></td>"
+    "<td>{value}</td>"
+    "<td><span class='{cls}'>{icon} {pct}</span></td>"
+    "</tr>"
+)
+
+# (css class, icon) per confidence bucket: low < 0.5 <= medium < 0.8 <= high
+_CONF = (
+    ("confidence-low", "🔴"),
+    ("confidence-medium", "🟡"),
+    ("confidence-high", "🟢")
+)
+
+# WAV sample formats FLAC can hold bit-for-bit, and the block size used to
+# re-encode them without decoding the whole recording at once
+_FLAC_SUBTYPES = frozenset(("PCM_16", "PCM_24"))
+_FLAC_BLOCK_FRAMES = 1 << 16
+
+def _encode_flac(audio_path):
     """
-    Send the audio file to the API for processing
+    Re-encode a 16- or 24-bit PCM WAV recording as lossless FLAC, roughly halving
+    the upload size. Returns None for other sample formats, which are sent as WAV.
     """
-    if audio_file is None:
-        return "<div class='container'><p class='error-message'>Please upload an audio file.</p></div>"
+    subtype = sf.info(audio_path).subtype
+    if subtype not in _FLAC_SUBTYPES:
+        return None
     
-    try:
-        # Prepare the file for upload
-        files = {
-               'file': ('recording.wav', open(audio_file, 'rb'), 'audio/wav')
-        }
-        data = {
-              'language': language
-        }
+    buf = io.BytesIO()
+    with sf.SoundFile(audio_path) as src, sf.SoundFile(
+        buf, "w", samplerate=src.samplerate, channels=src.channels, format="FLAC", subtype=subtype
+    ) as dst:
+        # Integer samples pass through at the source bit depth, block by block
+        for block in src.blocks(blocksize=_FLAC_BLOCK_FRAMES, dtype="int32"):
+            dst.write(block)
+    return buf.getvalue()
 
-        try:
-            # Call the API
-            response = requests.post(f"{API_URL}/process-audio", files=files)
-            response_data = response.json()
-            
-            # Create a formatted output
-            output = "<div class='container'>"
-            
-            # Always show transcript if available
-            transcript = response_data.get("transcript")
-            if transcript:
-                output += "<div class='transcript-section'>"
-                output += "<h2 class='subtitle'>Speech to Text Result</h2>"
-                output += f"<div class='transcript'>{transcript}</div>"
-                output += "</div>"
-            
-            # If there's an error, show it
-            if "error" in response_data:
-                error_msg = response_data.get("error")
-                details = response_data.get("details", "")
-                output += "<div class='error-message'>"
-                output += f"<p><strong>Error:</strong> {error_msg}</p>"
-                if details:
-                    output += f"<p><strong>Details:</strong> {details}</p>"
-                output += "</div>"
-            
-            # If there are fields, show them
-            fields = response_data.get("fields", [])
-            if fields:
-                output += "<h2 class='subtitle'>Extracted Fields</h2>"
-                output += "<table width='100%' style='border-collapse: collapse;'>"
-                output += "<tr><th style='text-align: left; padding: 8px; border-bottom: 1px solid #ddd;'>Field</th>"
-                output += "<th style='text-align: left; padding: 8px; border-bottom: 1px solid #ddd;'>Value</th>"
-                output += "<th style='text-align: left; padding: 8px; border-bottom: 1px solid #ddd;'>Confidence</th></tr>"
-                
-                for field in fields:
-                    name = field.get("field_name", "Unknown")
-                    value = field.get("field_value", "Not found")
-                    confidence = field.get("confidence_score", 0)
-                    
-                    # Format confidence as percentage
-                    confidence_pct = f"{confidence * 100:.1f}%"
-                    
-                    # Add color coding based on confidence
-                    if confidence >= 0.8:
-                        confidence_class = "confidence-high"
-                        confidence_icon = "🟢"
-                    elif confidence >= 0.5:
-                        confidence_class = "confidence-medium"
-                        confidence_icon = "🟡"
-                    else:
-                        confidence_class = "confidence-low"
-                        confidence_icon = "🔴"
-                    
-                    output += f"<tr style='border-bottom: 1px solid #ddd;'>"
-                    output += f"<td style='padding: 8px;'><span class='field-name'>{name}</span></td>"
-                    output += f"<td style='padding: 8px;'>{value}</td>"
-                    output += f"<td style='padding: 8px;'><span class='{confidence_class}'>{confidence_icon} {confidence_pct}</span></td>"
-                    output += "</tr>"
-                
-                output += "</table>"
-            
-            output += "</div>"
-            return output
-            
-        except requests.exceptions.RequestException as e:
-            return f"<div class='container'><p class='error-message'>Network Error: {str(e)}</p></div>"
-        
-    except Exception as e:
-        return f"<div class='container'><p class='error-message'>Error processing request: {str(e)}</p></div>"
+@lru_cache(maxsize=1024)
+def _render_field_row(name, value, confidence):
+    """
+    Render one extracted field as a table row with a color-coded confidence
+    """
+    # Color-code by bucket and format as a percentage, without branching
+    confidence_class, confidence_icon = _CONF[(confidence >= 0.5) + (confidence >= 0.8)]
+    confidence_pct = format(confidence, ".1%")
+    
+    return _ROW_TMPL.format(
+        name=_esc(name),
+        value=_esc(value),
+        cls=confidence_class,
+        icon=confidence_icon,
+        pct=confidence_pct
+    )
 
-def process_text(transcript_text, language="en"):
+def _field_triples(fields):
+    """
+    Project API field dicts onto hashable (name, value, confidence) triples
+    """
+    return tuple(
+        (
+            str(f.get("field_name", "Unknown")),
+            str(f.get("field_value", "Not found")),
+            f.get("confidence_score", 0)
+        )
+        for f in fields
+    )
+
+@lru_cache(maxsize=256)
+def _render_fields_html(fields_tuple):
+    """
+    Render the extracted-fields table shared by the audio and text views.
+    Takes the output of _field_triples so identical result sets are cached.
+    """
+    parts = [_TABLE_HEAD]
+    for name, value, confidence in fields_tuple:
+        parts.append(_render_field_row(name, value, confidence))
+    parts.append("</table>")
+    return "".join(parts)
+
+async def process_text(transcript_text, language="en"):
     """
     Send the transcript text to the API for processing
     """
     if not transcript_text or transcript_text.strip() == "":
         return "<div class='container'><p class='error-message'>Please enter a transcript.</p></div>"
     
+    cache_key = _result_cache_key(transcript_text, language)
+    cached = _RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        _RESULT_CACHE.move_to_end(cache_key)
+        return cached
+    
     try:
         # Call the API
-        response = requests.post(
-            f"{API_URL}/extract-fields", 
+        response = await _api_post(
+            _EXTRACT_FIELDS_URL, 
             data={
                 'transcript_text': transcript_text,
                 'language': language
@@ -195,74 +327,48 @@ def process_text(transcript_text, language="en"):
         
         # Check if the request was successful
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             
             # Format the extracted fields for display
             fields = data.get("fields", [])
             
             # Create a formatted output
-            output = f"<div class='container'>"
-            output += f"<h2 class='subtitle'>Transcript</h2>"
-            output += f"<p>{transcript_text}</p>"
-            output += f"<h2 class='subtitle'>Extracted Fields</h2>"
+            parts = ["<div class='container'>"]
+            parts.append("<h2 class='subtitle'>Transcript</h2>")
+            parts.append(f"<p>{_esc(transcript_text)}</p>")
+            parts.append("<h2 class='subtitle'>Extracted Fields</h2>")
             
             if fields:
                 # Sort fields by confidence score (highest first)
-                fields.sort(key=lambda x: x.get("confidence_score", 0), reverse=True)
+                keyed = [(f.get("confidence_score", 0), f) for f in fields]
+                keyed.sort(key=itemgetter(0), reverse=True)
+                fields = [f for _, f in keyed]
                 
-                output += "<table width='100%' style='border-collapse: collapse;'>"
-                output += "<tr><th style='text-align: left; padding: 8px; border-bottom: 1px solid #ddd;'>Field</th>"
-                output += "<th style='text-align: left; padding: 8px; border-bottom: 1px solid #ddd;'>Value</th>"
-                output += "<th style='text-align: left; padding: 8px; border-bottom: 1px solid #ddd;'>Confidence</th></tr>"
-                
-                for field in fields:
-                    name = field.get("field_name", "Unknown")
-                    value = field.get("field_value", "Not found")
-                    confidence = field.get("confidence_score", 0)
-                    
-                    # Format confidence as percentage
-                    confidence_pct = f"{confidence * 100:.1f}%"
-                    
-                    # Add color coding based on confidence
-                    if confidence >= 0.8:
-                        confidence_class = "confidence-high"
-                        confidence_icon = "🟢"
-                    elif confidence >= 0.5:
-                        confidence_class = "confidence-medium"
-                        confidence_icon = "🟡"
-                    else:
-                        confidence_class = "confidence-low"
-                        confidence_icon = "🔴"
-                    
-                    output += f"<tr style='border-bottom: 1px solid #ddd;'>"
-                    output += f"<td style='padding: 8px;'><span class='field-name'>{name}</span></td>"
-                    output += f"<td style='padding: 8px;'>{value}</td>"
-                    output += f"<td style='padding: 8px;'><span class='{confidence_class}'>{confidence_icon} {confidence_pct}</span></td>"
-                    output += "</tr>"
-                
-                output += "</table>"
+                parts.append(_render_fields_html(_field_triples(fields)))
             else:
-                output += "<p>No fields extracted.</p>"
+                parts.append("<p>No fields extracted.</p>")
             
-            output += "</div>"
+            parts.append("</div>")
+            output = "".join(parts)
+            _cache_result(cache_key, output)
             return output
         else:
             # Handle error responses
             try:
-                error_data = response.json()
+                error_data = orjson.loads(response.content)
                 error_msg = error_data.get("error", "Unknown error")
                 details = error_data.get("details", "No details provided")
-                return f"<div class='container'><p class='error-message'>{error_msg}: {details}</p></div>"
+                return f"<div class='container'><p class='error-message'>{_esc(str(error_msg))}: {_esc(str(details))}</p></div>"
             except:
-                return f"<div class='container'><p class='error-message'>Error: {response.status_code} - {response.text}</p></div>"
+                return f"<div class='container'><p class='error-message'>Error: {response.status_code} - {_esc(response.text)}</p></div>"
     
     except Exception as e:
-        return f"<div class='container'><p class='error-message'>Error processing request: {str(e)}</p></div>"
+        return f"<div class='container'><p class='error-message'>Error processing request: {_esc(str(e))}</p></div>"
 
 # Create the Gradio interface
 with gr.Blocks(title="FormsiQ - Mortgage Application Extractor", css=custom_css) as demo:
-    gr.HTML("<h1 class='title'>FormsiQ - Mortgage Application Extractor</h1>")
-    gr.HTML("<p>Extract mortgage application details from audio recordings or text transcripts.</p>")
+    gr.HTML(_TITLE_HTML)
+    gr.HTML(_INTRO_HTML)
     
     with gr.Tabs():
         with gr.TabItem("Audio Input"):
@@ -290,18 +396,37 @@ with gr.Blocks(title="FormsiQ - Mortgage Application Extractor", css=custom_css)
                     error_output = gr.HTML(label="Error Messages")
                     results_output = gr.HTML(label="Extracted Fields")
             
-            def process_audio_wrapper(audio_path, language):
+            async def process_audio_wrapper(audio_path, language):
+                # Generator handler: Gradio shows each yielded update as it
+                # arrives, so the user sees progress instead of a bare spinner
                 if audio_path is None:
-                    return "No audio recorded or uploaded.", "<div class='error-message'>Please provide audio input.</div>", None
+                    yield "No audio recorded or uploaded.", "<div class='error-message'>Please provide audio input.</div>", None
+                    return
+                
+                # Clear any previous results while the new request runs
+                yield "Uploading audio, transcribing and extracting fields...", None, None
                 
                 try:
-                    files = {
-                        'file': ('recording.wav', open(audio_path, 'rb'), 'audio/wav')
-                    }
                     data = {'language': language}
                     
-                    response = requests.post(f"{API_URL}/process-audio", files=files, data=data)
-                    response_data = response.json()
+                    # Compress to FLAC before uploading (off the event loop)
+                    try:
+                        flac_bytes = await asyncio.to_thread(_encode_flac, audio_path)
+                    except Exception:
+                        flac_bytes = None
+                    
+                    if flac_bytes is not None:
+                        files = {
+                            'file': ('recording.flac', flac_bytes, 'audio/flac')
+                        }
+                        response = await _api_post(_PROCESS_AUDIO_URL, files=files, data=data)
+                    else:
+                        # Fall back to streaming the raw WAV straight from disk
+                        body = await asyncio.to_thread(
+                            _MultipartFileBody, audio_path, 'file', 'recording.wav', 'audio/wav', data
+                        )
+                        response = await _api_post(_PROCESS_AUDIO_URL, content=body, headers=body.headers)
+                    response_data = orjson.loads(response.content)
                     
                     # Get transcript (always try to show it)
                     transcript = response_data.get("transcript", "")
@@ -312,63 +437,33 @@ with gr.Blocks(title="FormsiQ - Mortgage Application Extractor", css=custom_css)
                         details = response_data.get("details", "")
                         error_html = f"""
                             <div class='error-message'>
-                                <strong>Error:</strong> {error_msg}<br>
-                                {f"<strong>Details:</strong> {details}" if details else ""}
+                                <strong>Error:</strong> {_esc(str(error_msg))}<br>
+                                {f"<strong>Details:</strong> {_esc(str(details))}" if details else ""}
                             </div>
                         """
-                        return transcript, error_html, None
+                        yield transcript, error_html, None
+                        return
                     
                     # Format successful results with colored confidence scores
                     fields = response_data.get("fields", [])
+                    results_html = None
                     if fields:
-                        results_html = """
-                            <div class='container'>
-                                <table>
-                                    <tr>
-                                        <th>Field</th>
-                                        <th>Value</th>
-                                        <th>Confidence</th>
-                                    </tr>
-                        """
-                        
-                        for field in fields:
-                            name = field.get("field_name", "Unknown")
-                            value = field.get("field_value", "Not found")
-                            confidence = field.get("confidence_score", 0)
-                            
-                            # Add color coding based on confidence
-                            if confidence >= 0.8:
-                                confidence_class = "confidence-high"
-                                confidence_icon = "🟢"
-                            elif confidence >= 0.5:
-                                confidence_class = "confidence-medium"
-                                confidence_icon = "🟡"
-                            else:
-                                confidence_class = "confidence-low"
-                                confidence_icon = "🔴"
-                            
-                            results_html += f"""
-                                <tr>
-                                    <td><span class='field-name'>{name}</span></td>
-                                    <td>{value}</td>
-                                    <td><span class='{confidence_class}'>{confidence_icon} {confidence:.1%}</span></td>
-                                </tr>
-                            """
-                        
-                        results_html += """
-                            </table>
-                        </div>
-                        """
-                    return transcript, None, results_html
+                        results_html = "".join((
+                            "<div class='container'>",
+                            _render_fields_html(_field_triples(fields)),
+                            "</div>"
+                        ))
+                    yield transcript, None, results_html
                     
                 except Exception as e:
-                    return str(e), "<div class='error-message'>Failed to process audio.</div>", None
+                    yield str(e), "<div class='error-message'>Failed to process audio.</div>", None
             
             # Update the click event handler
             process_button.click(
                 fn=process_audio_wrapper,
                 inputs=[audio_input, language_dropdown],
-                outputs=[transcript_output, error_output, results_output]
+                outputs=[transcript_output, error_output, results_output],
+                concurrency_limit=4
             )
             
         with gr.TabItem("Text Input"):
@@ -391,9 +486,9 @@ with gr.Blocks(title="FormsiQ - Mortgage Application Extractor", css=custom_css)
                     text_error_output = gr.HTML(label="Error Messages", visible=True)
                     text_output = gr.HTML(label="Results")
             
-            def wrapped_process_text(text, lang):
+            async def wrapped_process_text(text, lang):
                 try:
-                    result = process_text(text, lang)
+                    result = await process_text(text, lang)
                     if "error-message" in result:
                         return result, None
                     return None, result
@@ -404,20 +499,15 @@ with gr.Blocks(title="FormsiQ - Mortgage Application Extractor", css=custom_css)
                 fn=wrapped_process_text,
                 inputs=[text_input, text_language],
                 outputs=[text_error_output, text_output],
-                api_name="process_text"
+                api_name="process_text",
+                concurrency_limit=4
             )
     
-    gr.HTML("""
-    <div class='instructions'>
-        <h3>Sample Transcripts</h3>
-        <p>Try these examples:</p>
-        <ol>
-            <li><strong>Complete Application:</strong> "Hi, my name is John Smith. I'd like to apply for a mortgage loan of $350,000. I'm looking to purchase a single-family home at 123 Main Street. My annual income is $120,000 and I've been employed at Tech Corp for 5 years as a software engineer. My credit score is around 750."</li>
-            <li><strong>Refinance Application:</strong> "I'm Robert Johnson calling about refinancing my current mortgage for $300,000. I've owned my home at 789 Oak Drive, Austin, TX for 8 years and the current value is approximately $500,000. I still owe about $300,000 on my mortgage and I'm looking to get a better interest rate."</li>
-        </ol>
-    </div>
-    """)
+    gr.HTML(_INSTRUCTIONS_HTML)
 
 # Launch the interface
 if __name__ == "__main__":
+    # Queue requests so concurrent users run in bounded parallel instead of
+    # overloading the transcription/extraction backend
+    demo.queue(default_concurrency_limit=4, max_size=32)
     demo.launch(share=True)  # Set share=False if you don't want to generate a public link